@@ -0,0 +1,284 @@
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+VISITORS_PATH = "/api/v1/developer/visitors"
+DOOR_GROUPS_PATH = "/api/v1/developer/door_groups"
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type="text/calendar"):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        return json.loads(self.body or b"{}")
+
+    def _handle(self, method):
+        # Always consume the body so injected faults leave the keep-alive
+        # connection in a clean state for the next request.
+        self.body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        url = urlparse(self.path)
+        route, params = self.server.fake.route(method, url.path)
+        self.server.fake.record(method, route)
+        if route is None:
+            self._send_json(404, {"code": "NOT_FOUND"})
+            return
+        fault = self.server.fake.inject_fault()
+        if fault == 429:
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.server.fake.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if fault:
+            self._send_json(fault, {"code": "UNAVAILABLE"})
+            return
+        handler = getattr(self.server.fake, f"handle_{route}")
+        handler(self, parse_qs(url.query), *params)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+class FakeServer:
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, seed=0, throttle_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.visitors = {}
+        self.reservations = []
+        self.door_groups = [{"id": "fake-door-group", "name": "Front Door"}]
+        self.request_counts = Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def route(self, method, path):
+        parts = [p for p in path.split("/") if p]
+        if path == VISITORS_PATH and method in ("GET", "POST"):
+            return ("list_visitors" if method == "GET" else "create_visitor"), ()
+        if path.startswith(VISITORS_PATH + "/"):
+            rest = parts[4:]
+            if len(rest) == 1 and method == "DELETE":
+                return "delete_visitor", (rest[0],)
+            if len(rest) == 2 and rest[1] == "pin_codes" and method == "PUT":
+                return "assign_pin", (rest[0],)
+        if path == DOOR_GROUPS_PATH and method == "GET":
+            return "door_groups", ()
+        if path.endswith("/reservations") and method == "GET":
+            return "reservations", ()
+        if path.endswith(".ics") and method == "GET":
+            return "ics", ()
+        return None, ()
+
+    def record(self, method, route):
+        with self._lock:
+            self.request_counts[f"{method} {route or 'unknown'}"] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_counts.clear()
+
+    def inject_fault(self):
+        with self._lock:
+            delay = self.latency + self.random.uniform(0, self.latency_jitter)
+            roll = self.random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            return 503
+        if roll < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def generate_reservations(self, count, today=None, seed=0):
+        # Check-ins spread from 10 days ago to 60 days ahead, so only part of
+        # the list falls inside the 30 day actionable window.
+        today = today or datetime.date.today()
+        rng = random.Random(seed)
+        self.reservations = []
+        for i in range(count):
+            check_in = today + datetime.timedelta(days=rng.randint(-10, 60))
+            check_out = check_in + datetime.timedelta(days=rng.randint(1, 7))
+            self.reservations.append({
+                "reservation_code": f"HM{i:08d}",
+                "property_id": 1 + i % 5,
+                "check_in_date": check_in.isoformat(),
+                "check_out_date": check_out.isoformat(),
+                "status": "accepted" if rng.random() > 0.1 else "cancelled",
+                "guests": [{"name": f"Guest {i}", "phone": f"+1555{i:07d}"}],
+            })
+        return self.reservations
+
+    def add_visitor(self, first_name, last_name, phone, start_time, end_time, pin_code=None, status="UPCOMING",
+                    resources=None):
+        visitor_id = str(uuid.uuid4())
+        with self._lock:
+            self.visitors[visitor_id] = {
+                "id": visitor_id,
+                "first_name": first_name,
+                "last_name": last_name,
+                "mobile_phone": phone,
+                "start_time": start_time,
+                "end_time": end_time,
+                "status": status,
+                "pin_code": pin_code,
+                "resources": resources or [],
+            }
+        return visitor_id
+
+    def handle_list_visitors(self, handler, query):
+        with self._lock:
+            visitors = list(self.visitors.values())
+        handler._send_json(200, {"code": "SUCCESS", "data": visitors})
+
+    def handle_create_visitor(self, handler, query):
+        data = handler._read_json()
+        visitor_id = self.add_visitor(data.get("first_name"), data.get("last_name"), data.get("mobile_phone"),
+                                      data.get("start_time"), data.get("end_time"),
+                                      resources=data.get("resources"))
+        with self._lock:
+            visitor = dict(self.visitors[visitor_id])
+        handler._send_json(200, {"code": "SUCCESS", "data": visitor})
+
+    def handle_delete_visitor(self, handler, query, visitor_id):
+        with self._lock:
+            found = self.visitors.pop(visitor_id, None) is not None
+        handler._send_json(200 if found else 404, {"code": "SUCCESS" if found else "NOT_FOUND"})
+
+    def handle_assign_pin(self, handler, query, visitor_id):
+        data = handler._read_json()
+        with self._lock:
+            visitor = self.visitors.get(visitor_id)
+            if visitor is not None:
+                visitor["pin_code"] = data.get("pin_code")
+        handler._send_json(200 if visitor is not None else 404, {"code": "SUCCESS" if visitor is not None else "NOT_FOUND"})
+
+    def handle_door_groups(self, handler, query):
+        handler._send_json(200, {"code": "SUCCESS", "data": self.door_groups})
+
+    def handle_reservations(self, handler, query):
+        reservations = self.reservations
+        if "status" in query:
+            reservations = [r for r in reservations if r["status"] == query["status"][0]]
+        if "property_id" in query:
+            reservations = [r for r in reservations if str(r["property_id"]) == query["property_id"][0]]
+        if "reservation_code" in query:
+            reservations = [r for r in reservations if r["reservation_code"] == query["reservation_code"][0]]
+        if "start_check_in_date" in query:
+            reservations = [r for r in reservations if r["check_in_date"] >= query["start_check_in_date"][0]]
+        if "end_check_in_date" in query:
+            reservations = [r for r in reservations if r["check_in_date"] <= query["end_check_in_date"][0]]
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(len(reservations) or 1)])[0])
+        page = reservations[offset:offset + limit]
+        handler._send_json(200, {"data": {"reservations": page, "total": len(reservations)}})
+
+    def handle_ics(self, handler, query):
+        handler._send_text(200, self.ics_feed())
+
+    def ics_feed(self):
+        lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Fake Airbnb//EN"]
+        for reservation in self.reservations:
+            if reservation["status"] != "accepted":
+                continue
+            check_in = reservation["check_in_date"].replace("-", "")
+            check_out = reservation["check_out_date"].replace("-", "")
+            phone = reservation["guests"][0]["phone"][-4:]
+            lines += [
+                "BEGIN:VEVENT",
+                f"DTSTART;VALUE=DATE:{check_in}",
+                f"DTEND;VALUE=DATE:{check_out}",
+                f"UID:{reservation['reservation_code']}@airbnb.com",
+                "SUMMARY:Reserved",
+                f"DESCRIPTION:Reservation URL: https://www.airbnb.com/hosting/reservations/details/"
+                f"{reservation['reservation_code']}\\nPhone Number (Last 4 Digits): {phone}",
+                "END:VEVENT",
+            ]
+        lines.append("END:VCALENDAR")
+        return "\r\n".join(lines) + "\r\n"
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline fake UniFi Access / Hostex / Airbnb ICS server")
+    parser.add_argument('--reservations', type=int, default=100, help="Number of reservations to generate")
+    parser.add_argument('--latency', type=float, default=0.0, help="Fixed per-request latency in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Random extra latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429 responses")
+    args = parser.parse_args()
+
+    server = FakeServer(args.latency, args.latency_jitter, args.error_rate,
+                        throttle_rate=args.throttle_rate, retry_after=args.retry_after).start()
+    server.generate_reservations(args.reservations)
+    print(f"Fake server listening on {server.url}")
+    print(f"  UniFi Access: api_host = {server.url}")
+    print(f"  Hostex:       api_url = {server.url}/v3")
+    print(f"  Airbnb ICS:   ics_url = {server.url}/calendar.ics")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,170 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from bench.fake_server import FakeServer
+from hostex_api import HostexManager
+from ics_parser import ICSParser
+from unifi_access import UnifiAccessManager
+from utils import actionable_window
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+def make_config(server, workdir, args):
+    return {
+        'api_host': server.url,
+        'api_token': 'fake-token',
+        'max_workers': args.workers,
+        'hostex_api_url': f"{server.url}/v3",
+        'hostex_api_key': 'fake-key',
+        'hostex_page_size': 100,
+        'hostex_property_id': None,
+        'ics_url': f"{server.url}/calendar.ics",
+        'default_door_group_id': server.door_groups[0]['id'],
+        'check_in_time': '16:00:00',
+        'check_out_time': '11:00:00',
+        'pin_code_digits': 4,
+        'cache_dir': os.path.join(workdir, 'cache'),
+        'state_db': os.path.join(workdir, 'state.db'),
+        'http_pool_size': max(10, args.workers),
+        'http_connect_timeout': 5,
+        'http_timeout': 30,
+        'http_max_retries': args.max_retries,
+        'http_backoff_base': 0.05,
+        'http_backoff_max': 1,
+        'http_rate_limit': args.rate_limit,
+        'http_rate_burst': max(1, int(args.rate_limit * 2)),
+    }
+
+def seed_stale_visitors(server, count):
+    # Visitors whose stay ended last week; every sync should delete them.
+    end = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=7), datetime.time(11))
+    start = end - datetime.timedelta(days=3)
+    for i in range(count):
+        server.add_visitor(f"Stale{i}", "Guest", f"+1666{i:07d}", int(start.timestamp()), int(end.timestamp()), "1234")
+
+def expected_creates(server):
+    first_day, last_day = actionable_window()
+    return sum(1 for r in server.reservations
+               if r["status"] == "accepted" and first_day.isoformat() <= r["check_in_date"] <= last_day.isoformat())
+
+def check_result(result):
+    # Both sources must produce the same sync: every actionable reservation
+    # created on the cold run and nothing left to do on the warm one.
+    problems = []
+    if result['cold']['added'] != result['expected_added']:
+        problems.append(f"cold run added {result['cold']['added']} visitors, expected {result['expected_added']}")
+    if result['warm']['added'] or result['warm']['deleted']:
+        problems.append(f"warm run changed visitors (+{result['warm']['added']} -{result['warm']['deleted']})")
+    return problems
+
+def run_sync(config, source):
+    unifi_manager = UnifiAccessManager(config)
+    if source == 'hostex':
+        reservations = HostexManager(config).iter_reservations(*actionable_window())
+    else:
+        reservations = ICSParser(config).parse_ics()
+    unifi_manager.process_reservations(reservations)
+    unifi_manager.check_and_update_pins()
+    unifi_manager.close()
+    return unifi_manager.changes
+
+def measure(server, config, source, trace_memory):
+    server.reset_counts()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    changes = run_sync(config, source)
+    wall_time = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        'wall_time_s': round(wall_time, 4),
+        'peak_memory_kib': round(peak / 1024, 1) if peak is not None else None,
+        'requests': dict(sorted(server.request_counts.items())),
+        'total_requests': sum(server.request_counts.values()),
+        'added': len(changes['added']),
+        'deleted': len(changes['deleted']),
+        'unchanged': len(changes['unchanged']),
+    }
+
+def run_scenario(size, args, trace_memory):
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeServer(args.latency, args.latency_jitter, args.error_rate, seed=size,
+                       throttle_rate=args.throttle_rate, retry_after=0) as server:
+        server.generate_reservations(size, seed=size)
+        seed_stale_visitors(server, max(1, size // 10))
+        config = make_config(server, workdir, args)
+        # Cold: empty state store; warm: an immediate re-sync with nothing to change.
+        cold = measure(server, config, args.source, trace_memory)
+        warm = measure(server, config, args.source, trace_memory)
+        cold['expected_added'] = expected_creates(server)
+        return cold, warm
+
+def bench_size(size, args):
+    # tracemalloc slows every allocation (including the fake server's), so
+    # timings come from an untraced pass and memory from a separate one.
+    result = {'reservations': size, 'source': args.source}
+    timed = run_scenario(size, args, trace_memory=False)
+    traced = run_scenario(size, args, trace_memory=True) if args.memory else (None, None)
+    for phase, timed_run, traced_run in zip(('cold', 'warm'), timed, traced):
+        if traced_run:
+            timed_run['peak_memory_kib'] = traced_run['peak_memory_kib']
+        result[phase] = timed_run
+    result['expected_added'] = result['cold'].pop('expected_added')
+    return result
+
+def print_result(result):
+    print(f"{result['reservations']:>6} reservations ({result['source']})")
+    for phase in ('cold', 'warm'):
+        r = result[phase]
+        memory = f"{r['peak_memory_kib']:>10.1f} KiB peak" if r['peak_memory_kib'] is not None else f"{'-':>19}"
+        print(f"  {phase:<5} {r['wall_time_s']:>9.3f}s  {r['total_requests']:>6} requests  {memory}  "
+              f"+{r['added']} -{r['deleted']} ={r['unchanged']}")
+        for endpoint, count in r['requests'].items():
+            print(f"          {count:>6}  {endpoint}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a full sync against the offline fake server")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Reservation counts to benchmark")
+    parser.add_argument('--source', choices=('hostex', 'ics'), default='hostex', help="Reservation source to use")
+    parser.add_argument('--workers', type=int, default=4, help="Value for [UniFi] max_workers")
+    parser.add_argument('--latency', type=float, default=0.0, help="Fixed per-request latency in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Random extra latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--max-retries', type=int, default=3, help="Value for [HTTP] max_retries")
+    parser.add_argument('--rate-limit', type=float, default=0, help="Value for [HTTP] rate_limit (0 disables it)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="Skip the peak memory pass")
+    parser.add_argument('--json', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    results = []
+    failed = False
+    for size in args.sizes:
+        result = bench_size(size, args)
+        print_result(result)
+        result['problems'] = check_result(result)
+        for problem in result['problems']:
+            print(f"  MISMATCH: {problem}")
+        # Injected faults can legitimately leave work undone
+        failed = failed or (bool(result['problems']) and not (args.error_rate or args.throttle_rate))
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
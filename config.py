@@ -1,8 +1,52 @@
 import configparser
 import logging
+import os
+import re
 
 logger = logging.getLogger(__name__)
 
+PROPERTY_SECTION_PREFIX = 'Property:'
+
+# Per-property keys that override the global settings, as (option, config key)
+PROPERTY_OVERRIDES = (
+    ('api_host', 'api_host'),
+    ('api_token', 'api_token'),
+    ('default_group_id', 'default_door_group_id'),
+    ('hostex_api_key', 'hostex_api_key'),
+    ('hostex_property_id', 'hostex_property_id'),
+    ('ics_url', 'ics_url'),
+    ('state_db', 'state_db'),
+)
+
+def load_properties(config, settings):
+    sections = [s for s in config.sections() if s.startswith(PROPERTY_SECTION_PREFIX)]
+    if not sections:
+        return [dict(settings, property_name='default')]
+
+    properties = []
+    state_db_root, state_db_ext = os.path.splitext(settings['state_db'])
+    for section in sections:
+        name = section[len(PROPERTY_SECTION_PREFIX):].strip()
+        # The name ends up in a file name, so path separators and the like go
+        safe_name = re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+        prop = dict(settings, property_name=name, state_db=f"{state_db_root}_{safe_name}{state_db_ext}")
+        for option, key in PROPERTY_OVERRIDES:
+            if config.has_option(section, option):
+                prop[key] = config.get(section, option)
+        if config.has_option(section, 'hostex_property_id') or config.has_option(section, 'hostex_api_key'):
+            prop['use_hostex'] = True
+        elif config.has_option(section, 'ics_url'):
+            prop['use_hostex'] = False
+            prop['use_ics'] = True
+        logger.debug("Loaded property %s for controller %s", name, prop['api_host'])
+        properties.append(prop)
+    # Properties on the same controller see each other's visitors, so each
+    # one is limited to the visitors on its own door group.
+    hosts = [prop['api_host'] for prop in properties]
+    for prop in properties:
+        prop['shared_controller'] = hosts.count(prop['api_host']) > 1
+    return properties
+
 def load_config():
     config = configparser.ConfigParser()
     config.read('unifi.conf')
@@ -16,23 +60,53 @@ def load_config():
     else:
         logger.debug("Found default_group_id in config: %s", config['Door']['default_group_id'])
 
-    return {
+    settings = {
         'api_host': config['UniFi']['api_host'],
         'api_token': config['UniFi']['api_token'],
+        'max_workers': config.getint('UniFi', 'max_workers', fallback=4),
         'hostex_api_url': config['Hostex']['api_url'],
         'hostex_api_key': config['Hostex']['api_key'],
+        'hostex_page_size': config.getint('Hostex', 'page_size', fallback=100),
+        'hostex_property_id': config.get('Hostex', 'property_id', fallback=None),
         'ics_url': config.get('Airbnb', 'ics_url', fallback=None),
         'simplepush_enabled': config['Simplepush'].getboolean('enabled', fallback=False),
         'simplepush_key': config['Simplepush'].get('key', fallback=None),
         'simplepush_url': config['Simplepush'].get('url', fallback=None),
+        'simplepush_digest_minutes': config['Simplepush'].getfloat('digest_minutes', fallback=0),
+        'simplepush_max_attempts': config['Simplepush'].getint('max_attempts', fallback=3),
+        'simplepush_flush_timeout': config['Simplepush'].getfloat('flush_timeout', fallback=10),
         'default_door_group_id': config['Door'].get('default_group_id', ''),
+        'door_group_cache_ttl_minutes': config['Door'].getfloat('cache_ttl_minutes', fallback=1440),
         'check_in_time': config['Visitor']['check_in_time'],
         'check_out_time': config['Visitor']['check_out_time'],
         'use_hostex': 'Hostex' in config and config['Hostex']['api_key'],
         'use_ics': config.get('Airbnb', 'ics_url', fallback=None) is not None,
         'log_file': config['General']['log_file'],
-        'pin_code_digits': int(config['General']['pin_code_digits'])
+        'cache_dir': config.get('General', 'cache_dir', fallback='cache'),
+        'state_db': config.get('General', 'state_db', fallback='unifi_access_state.db'),
+        'pin_code_digits': int(config['General']['pin_code_digits']),
+        'max_parallel_properties': config.getint('General', 'max_parallel_properties', fallback=8),
+        'max_concurrent_per_controller': config.getint('General', 'max_concurrent_per_controller', fallback=2),
+        'daemon_interval_minutes': config.getfloat('Daemon', 'interval_minutes', fallback=15),
+        'daemon_jitter_seconds': config.getfloat('Daemon', 'jitter_seconds', fallback=60),
+        'daemon_boundary_lead_minutes': config.getfloat('Daemon', 'boundary_lead_minutes', fallback=15),
+        'metrics_prometheus_file': config.get('Metrics', 'prometheus_file', fallback=None) or None,
+        'metrics_json_report': config.get('Metrics', 'json_report', fallback=None) or None,
+        'metrics_port': config.getint('Metrics', 'port', fallback=0),
+        'webhook_port': config.getint('Webhook', 'port', fallback=0),
+        'webhook_path': config.get('Webhook', 'path', fallback='/webhooks/hostex'),
+        'webhook_secret': config.get('Webhook', 'secret', fallback=None) or None,
+        'http_pool_size': config.getint('HTTP', 'pool_size', fallback=10),
+        'http_connect_timeout': config.getfloat('HTTP', 'connect_timeout', fallback=5),
+        'http_timeout': config.getfloat('HTTP', 'timeout', fallback=30),
+        'http_max_retries': config.getint('HTTP', 'max_retries', fallback=3),
+        'http_backoff_base': config.getfloat('HTTP', 'backoff_base', fallback=0.5),
+        'http_backoff_max': config.getfloat('HTTP', 'backoff_max', fallback=30),
+        'http_rate_limit': config.getfloat('HTTP', 'rate_limit', fallback=20),
+        'http_rate_burst': config.getint('HTTP', 'rate_burst', fallback=40)
     }
+    settings['properties'] = load_properties(config, settings)
+    return settings
 
     logger.debug("Loaded configuration: %s", {k: v for k, v in config.items() if k != 'api_token'})
     return config
@@ -1,23 +1,58 @@
-import requests
 import logging
+from http_client import create_session
+from utils import actionable_window
 
 class HostexManager:
     def __init__(self, config):
         self.api_url = config['hostex_api_url']
         self.api_key = config['hostex_api_key']
+        self.page_size = config.get('hostex_page_size', 100)
+        self.property_id = config.get('hostex_property_id')
         self.logger = logging.getLogger(__name__)
-
-    def fetch_reservations(self):
-        url = f"{self.api_url}/reservations"
-        headers = {
+        self.session = create_session(config, headers={
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            reservations = response.json()["data"]["reservations"]
-            self.logger.debug(f"Fetched {len(reservations)} reservations from Hostex")
-            return reservations
-        else:
-            self.logger.error(f"Failed to fetch reservations from Hostex. Status code: {response.status_code}")
-            return []
+        })
+
+    def iter_reservations(self, start_check_in_date=None, end_check_in_date=None, status="accepted"):
+        url = f"{self.api_url}/reservations"
+        params = {"offset": 0, "limit": self.page_size}
+        if start_check_in_date:
+            params["start_check_in_date"] = start_check_in_date.isoformat()
+        if end_check_in_date:
+            params["end_check_in_date"] = end_check_in_date.isoformat()
+        if status:
+            params["status"] = status
+        if self.property_id:
+            params["property_id"] = self.property_id
+
+        while True:
+            response = self.session.get(url, params=params)
+            if response.status_code != 200:
+                self.logger.error(f"Failed to fetch reservations from Hostex. Status code: {response.status_code}")
+                return
+            data = response.json()["data"]
+            reservations = data["reservations"]
+            self.logger.debug("Fetched %s reservations from Hostex at offset %s", len(reservations), params['offset'])
+            yield from reservations
+            # Hostex may cap the page below the requested limit, so a short
+            # page is not the end; stop at the reported total or an empty page.
+            params["offset"] += len(reservations)
+            total = data.get("total")
+            if not reservations or (total is not None and params["offset"] >= total):
+                return
+
+    def fetch_reservation(self, reservation_code):
+        # Any status, so cancellations delivered by webhook are visible too.
+        params = {"reservation_code": reservation_code}
+        if self.property_id:
+            params["property_id"] = self.property_id
+        response = self.session.get(f"{self.api_url}/reservations", params=params)
+        if response.status_code != 200:
+            self.logger.error(f"Failed to fetch reservation {reservation_code} from Hostex. Status code: {response.status_code}")
+            return None
+        reservations = response.json()["data"]["reservations"]
+        return next((r for r in reservations if r.get("reservation_code") == reservation_code), None)
+
+    def fetch_reservations(self):
+        return list(self.iter_reservations(*actionable_window()))
@@ -0,0 +1,158 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.min_rate = rate / 20
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def acquire(self):
+        # Tokens may go negative; the caller then sleeps for its share of the
+        # deficit, which keeps concurrent callers in FIFO-ish order.
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = max(0.0, self.updated - now) + max(0.0, -self.tokens) / self.rate
+        if wait:
+            time.sleep(wait)
+
+    def penalize(self, delay):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0)
+            self.updated = max(self.updated, now + delay)
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_bucket(host, rate, capacity):
+    # Shared by every session talking to the same host, so parallel clients
+    # (several properties on one controller) respect a single limit.
+    with _buckets_lock:
+        if host not in _buckets:
+            _buckets[host] = TokenBucket(rate, capacity)
+        return _buckets[host]
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+class PooledSession(requests.Session):
+    def __init__(self, timeout, max_retries=3, backoff_base=0.5, backoff_max=30, rate_limit=20, rate_burst=40):
+        super().__init__()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+
+    def backoff(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        method = method.upper()
+        parts = urlsplit(url)
+        bucket = get_bucket(parts.netloc, self.rate_limit, self.rate_burst) if self.rate_limit > 0 else None
+        # Non-idempotent calls are only retried on 429, where the server has
+        # explicitly refused to process the request.
+        idempotent = method in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            if bucket:
+                bucket.acquire()
+            started = time.perf_counter()
+            try:
+                response = super().request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                metrics.observe_request(parts.netloc, method, parts.path, 'error', time.perf_counter() - started)
+                if not isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                    raise
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning("%s %s failed (%s), retrying in %.1fs", method, url, e, delay)
+            else:
+                metrics.observe_request(parts.netloc, method, parts.path, response.status_code, time.perf_counter() - started)
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if bucket:
+                    if response.status_code == 429:
+                        bucket.penalize(retry_after if retry_after is not None else self.backoff(attempt))
+                    else:
+                        bucket.reward()
+                retryable = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+                if not retryable or attempt >= self.max_retries:
+                    return response
+                delay = retry_after if retry_after is not None else self.backoff(attempt)
+                delay = min(delay, self.backoff_max)
+                logger.warning("%s %s returned %s, retrying in %.1fs", method, url, response.status_code, delay)
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+def create_session(config, headers=None, verify=True):
+    pool_size = config.get('http_pool_size', 10)
+    timeout = (config.get('http_connect_timeout', 5), config.get('http_timeout', 30))
+
+    session = PooledSession(
+        timeout,
+        max_retries=config.get('http_max_retries', 3),
+        backoff_base=config.get('http_backoff_base', 0.5),
+        backoff_max=config.get('http_backoff_max', 30),
+        rate_limit=config.get('http_rate_limit', 20),
+        rate_burst=config.get('http_rate_burst', 40),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = verify
+    if not verify:
+        # Controllers use self-signed certificates
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    if headers:
+        session.headers.update(headers)
+
+    logger.debug("Created HTTP session with pool size %s and timeout %s", pool_size, timeout)
+    return session
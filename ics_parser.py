@@ -1,23 +1,120 @@
-import requests
-import icalendar
 import datetime
+import hashlib
 import logging
+import os
+from http_client import create_session
+from utils import actionable_window, read_json, write_json_atomic
 
 class ICSParser:
     def __init__(self, config):
         self.ics_url = config['ics_url']
         self.logger = logging.getLogger(__name__)
+        self.session = create_session(config)
+        cache_key = hashlib.sha256((self.ics_url or '').encode()).hexdigest()[:16]
+        self.body_cache_path = os.path.join(config.get('cache_dir', 'cache'), f"ics_{cache_key}.ics")
+        self.meta_cache_path = os.path.join(config.get('cache_dir', 'cache'), f"ics_{cache_key}.json")
 
     def parse_ics(self):
-        response = requests.get(self.ics_url)
-        cal = icalendar.Calendar.from_ical(response.text)
+        today = datetime.date.today()
+        meta = read_json(self.meta_cache_path) if os.path.exists(self.body_cache_path) else None
+        if meta and not meta.get('hash'):
+            # Incomplete cache entry; fetch the whole feed again
+            meta = None
+
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = self.session.get(self.ics_url, headers=headers)
+        if response.status_code == 304 and meta:
+            self.logger.debug("ICS feed not modified since last fetch")
+            content_hash = meta.get('hash')
+            body = None
+        elif response.status_code == 200:
+            body = response.text
+            content_hash = hashlib.sha256(body.encode()).hexdigest()
+        else:
+            self.logger.error(f"Failed to fetch ICS feed. Status code: {response.status_code}")
+            return []
+
+        # The parsed result depends on the actionable window as well as the
+        # feed, so it is only reused on the day it was produced.
+        if meta and meta.get('hash') == content_hash and meta.get('parsed_on') == today.isoformat() \
+                and 'reservations' in meta:
+            self.logger.debug("ICS feed unchanged, reusing parsed reservations")
+            reservations = [self._deserialize(r) for r in meta['reservations']]
+        else:
+            if body is None:
+                with open(self.body_cache_path) as f:
+                    body = f.read()
+            reservations = self._parse_events(body, today)
+
+        # The cache only saves work on later runs, so failing to write it
+        # must not fail this sync.
+        try:
+            if response.status_code == 200 and (not meta or meta.get('hash') != content_hash):
+                self._write_body(body)
+            write_json_atomic(self.meta_cache_path, {
+                'etag': response.headers.get('ETag') or (meta or {}).get('etag'),
+                'last_modified': response.headers.get('Last-Modified') or (meta or {}).get('last_modified'),
+                'hash': content_hash,
+                'parsed_on': today.isoformat(),
+                'reservations': [self._serialize(r) for r in reservations]
+            })
+        except OSError as e:
+            self.logger.warning(f"Failed to cache ICS feed: {str(e)}")
+        self.logger.debug(f"Parsed {len(reservations)} reservations from ICS file")
+        return reservations
+
+    def _write_body(self, body):
+        os.makedirs(os.path.dirname(self.body_cache_path) or '.', exist_ok=True)
+        tmp_path = f"{self.body_cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(body)
+        os.replace(tmp_path, self.body_cache_path)
+
+    def _iter_event_blocks(self, body):
+        block = None
+        for line in body.splitlines():
+            if line.startswith("BEGIN:VEVENT"):
+                block = [line]
+            elif block is not None:
+                block.append(line)
+                if line.startswith("END:VEVENT"):
+                    yield block
+                    block = None
+
+    def _block_date(self, block, prop):
+        for line in block:
+            if line.startswith(prop) and line[len(prop)] in ":;":
+                value = line.rsplit(":", 1)[1].strip()
+                return datetime.date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+        return None
+
+    def _parse_events(self, body, today):
+        # Imported here so runs that reuse the cached parse never load icalendar
+        import icalendar
+        first_day, last_day = actionable_window(today)
         reservations = []
-        for event in cal.walk("VEVENT"):
+        skipped = 0
+        for block in self._iter_event_blocks(body):
+            # Check the raw DTSTART/DTEND lines first so events outside the
+            # actionable window never go through the full iCalendar parser.
+            start = self._block_date(block, "DTSTART")
+            end = self._block_date(block, "DTEND")
+            if (end and end < first_day) or (start and start > last_day):
+                skipped += 1
+                continue
+
+            event = icalendar.Event.from_ical("\r\n".join(block))
             start = event.get("DTSTART").dt
             end = event.get("DTEND").dt
             description = event.get("DESCRIPTION", "")
             if not description:
-                self.logger.debug(f"Skipping event with start date {start.date()} due to missing description")
+                self.logger.debug("Skipping event with start date %s due to missing description", start)
                 continue
             pin_code = ""
             for line in description.split("\n"):
@@ -25,10 +122,21 @@ class ICSParser:
                     pin_code = line.split(": ")[1].strip()
                     break
             reservations.append({
+                "reservation_code": str(event.get("UID", "")) or None,
                 "check_in_date": start.date() if isinstance(start, datetime.datetime) else start,
                 "check_out_date": end.date() if isinstance(end, datetime.datetime) else end,
                 "guests": [{"name": "Airbnb Guest", "phone": pin_code}],
                 "status": "accepted"
             })
-        self.logger.debug(f"Parsed {len(reservations)} reservations from ICS file")
+        self.logger.debug(f"Skipped {skipped} events outside the actionable window")
         return reservations
+
+    def _serialize(self, reservation):
+        return dict(reservation,
+                    check_in_date=reservation["check_in_date"].isoformat(),
+                    check_out_date=reservation["check_out_date"].isoformat())
+
+    def _deserialize(self, reservation):
+        return dict(reservation,
+                    check_in_date=datetime.date.fromisoformat(reservation["check_in_date"]),
+                    check_out_date=datetime.date.fromisoformat(reservation["check_out_date"]))
@@ -1,84 +1,79 @@
 import argparse
 import logging
-import urllib3
 from config import load_config
-from unifi_access import UnifiAccessManager
-from hostex_api import HostexManager
-from ics_parser import ICSParser
-from notification import NotificationManager
 from utils import setup_logging
 
-# Suppress InsecureRequestWarning
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
 def main():
     parser = argparse.ArgumentParser(description="UniFi Access Visitor Management")
     parser.add_argument('-v', '--verbose', action='store_true', help="Increase output verbosity")
     parser.add_argument('-l', '--log', help="Log output to file")
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024, help="Rotate the log file at this size")
+    parser.add_argument('--log-backups', type=int, default=5, help="Number of rotated log files to keep")
     parser.add_argument('--list-door-groups', action='store_true', help="List available door groups")
+    parser.add_argument('--daemon', action='store_true', help="Keep running and re-sync on a schedule")
+    parser.add_argument('--plan', action='store_true', help="Show the changes a sync would make without applying them")
     args = parser.parse_args()
 
     # Initialize logging first
     logger = logging.getLogger(__name__)
     log_file = args.log or 'unifi_access.log'  # Default log file if not specified
-    logger = setup_logging(args.verbose, log_file)
+    logger = setup_logging(args.verbose, log_file, args.log_max_bytes, args.log_backups)
 
     try:
         config = load_config()
-        logger.debug(f"Loaded config: {config}")
+        logger.debug("Loaded config: %s", config)
     except Exception as e:
         logger.error(f"Error loading configuration: {str(e)}")
         return
 
-    try:
-        unifi_manager = UnifiAccessManager(config)
-    except ValueError as e:
-        logger.error(f"Error initializing UnifiAccessManager: {str(e)}")
-        return
+    # Heavier modules are imported only once we know which code path runs, so
+    # --help, config errors and --list-door-groups start quickly.
+    from unifi_access import UnifiAccessManager
 
     if args.list_door_groups:
-        unifi_manager.print_door_groups()
+        for prop in config['properties']:
+            try:
+                unifi_manager = UnifiAccessManager(prop)
+            except ValueError as e:
+                logger.error(f"Error initializing UnifiAccessManager: {str(e)}")
+                continue
+            if len(config['properties']) > 1:
+                print(f"Property: {prop['property_name']}")
+            unifi_manager.print_door_groups()
         return
 
-    hostex_manager = HostexManager(config)
-    ics_parser = ICSParser(config)
-    notification_manager = NotificationManager(config)
+    from sync import PortfolioSyncManager
+    sync_manager = PortfolioSyncManager(config)
+
+    if args.plan:
+        plan = sync_manager.plan()
+        print(plan if plan is not None else "Failed to compute a sync plan.")
+        return
+
+    if args.daemon:
+        from metrics import metrics
+        from scheduler import SyncScheduler
+        if config['metrics_port']:
+            metrics.serve(config['metrics_port'])
+        if config['webhook_port']:
+            from webhook import WebhookReceiver
+            try:
+                WebhookReceiver(config, sync_manager.sync_reservation).serve()
+            except (ValueError, OSError) as e:
+                logger.error(f"Webhook receiver not started: {str(e)}")
+        SyncScheduler(config, sync_manager.run).run()
+        sync_manager.close()
+        return
 
     try:
         logger.info("Script started")
-        
-        if config['use_hostex']:
-            logger.info("Fetching reservations from Hostex")
-            reservations = hostex_manager.fetch_reservations()
-        elif config['use_ics']:
-            logger.info("Parsing ICS file")
-            reservations = ics_parser.parse_ics()
-        else:
-            logger.error("No valid reservation source configured")
+        if sync_manager.run() is None:
             return
-
-        logger.info(f"Processing {len(reservations)} reservations")
-        unifi_manager.process_reservations(reservations)
-        
-        logger.info("Checking and updating PINs for existing visitors")
-        unifi_manager.check_and_update_pins()
-        
-        summary = unifi_manager.generate_summary()
-        logger.info(summary)
-
-        total_visitors = len(unifi_manager.fetch_visitors())
-        logger.info(f"Total visitors remaining after cleanup: {total_visitors}")
-
-        if config['simplepush_enabled'] and unifi_manager.has_changes():
-            notification_manager.send_notification("UniFi Access Update", summary)
-            logger.info("Simplepush notification sent")
-        else:
-            logger.info("No Simplepush notification sent (no changes or Simplepush not enabled)")
-
         logger.info("Script completed successfully")
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
     finally:
+        sync_manager.close()
         logger.info("Script execution finished")
 
 if __name__ == "__main__":
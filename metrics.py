@@ -0,0 +1,228 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from utils import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Path segments that look like ids (UUIDs, long hex or numeric ids) are
+# collapsed so per-visitor URLs share one endpoint label.
+ID_SEGMENT = re.compile(r'^(?=.*\d)[0-9a-fA-F-]{8,}$|^\d+$')
+
+def endpoint_label(path):
+    return "/".join("{id}" if ID_SEGMENT.match(segment) else segment for segment in path.split("/"))
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+def _labels_str(labels):
+    return ",".join(f"{name}={value}" for name, value in sorted(labels.items()))
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+class TimedIterator:
+    # Adds up the time spent producing items, so a streaming source's fetch
+    # time can be told apart from the work done on each item it yields.
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self._iterator)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._run = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, phase, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(phase, time.perf_counter() - started, **labels)
+
+    def record_phase(self, phase, elapsed, **labels):
+        self.observe('sync_phase_duration_seconds', elapsed, phase=phase, **labels)
+        with self._lock:
+            if self._run is not None:
+                self._run['phases'].append(dict(labels, phase=phase, seconds=round(elapsed, 6)))
+
+    def timed(self, operation, func):
+        def wrapper():
+            started = time.perf_counter()
+            try:
+                return func()
+            finally:
+                self.observe('sync_operation_duration_seconds', time.perf_counter() - started, operation=operation)
+        return wrapper
+
+    def observe_request(self, host, method, path, status, elapsed):
+        endpoint = endpoint_label(path)
+        self.inc('http_requests_total', host=host, method=method, endpoint=endpoint, status=status)
+        self.observe('http_request_duration_seconds', elapsed, host=host, method=method, endpoint=endpoint)
+        with self._lock:
+            if self._run is not None:
+                labels = _labels_str({'host': host, 'method': method, 'endpoint': endpoint, 'status': status})
+                self._run['http'].setdefault(labels, []).append(elapsed)
+
+    def start_run(self):
+        with self._lock:
+            self._run = {'started_at': time.time(), 'started': time.perf_counter(), 'phases': [], 'http': {}}
+
+    def finish_run(self, success):
+        with self._lock:
+            run, self._run = self._run, None
+        if run is None:
+            return None
+        duration = time.perf_counter() - run['started']
+        self.inc('sync_runs_total', result='success' if success else 'failure')
+        self.observe('sync_duration_seconds', duration)
+        if success:
+            self.set('sync_last_success_timestamp_seconds', time.time())
+
+        requests = []
+        for labels, latencies in sorted(run['http'].items()):
+            latencies = sorted(latencies)
+            requests.append({
+                'labels': labels,
+                'count': len(latencies),
+                'p50_seconds': round(_percentile(latencies, 0.5), 6),
+                'p95_seconds': round(_percentile(latencies, 0.95), 6),
+                'max_seconds': round(latencies[-1], 6),
+            })
+        return {
+            'started_at': run['started_at'],
+            'duration_seconds': round(duration, 6),
+            'success': success,
+            'phases': run['phases'],
+            'http_requests': requests,
+            'total_http_requests': sum(r['count'] for r in requests),
+        }
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            seen = set()
+            for (name, key), value in counters:
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{_format_labels(key)} {value}")
+            for (name, key), value in gauges:
+                if name not in seen:
+                    lines.append(f"# TYPE {name} gauge")
+                    seen.add(name)
+                lines.append(f"{name}{_format_labels(key)} {value}")
+            for (name, key), histogram in histograms:
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def serve(self, port, host=''):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving Prometheus metrics on port {server.server_address[1]}")
+        return server
+
+def export_run(report, config):
+    if config.get('metrics_prometheus_file'):
+        metrics.write_prometheus(config['metrics_prometheus_file'])
+    if config.get('metrics_json_report') and report is not None:
+        write_json_atomic(config['metrics_json_report'], report)
+
+metrics = Metrics()
@@ -1,20 +1,140 @@
-import requests
 import logging
+import os
+import queue
+import random
+import threading
+import time
+import requests
+from http_client import create_session
+from utils import read_json, write_json_atomic
 
 class NotificationManager:
     def __init__(self, config):
         self.enabled = config['simplepush_enabled']
         self.key = config['simplepush_key']
         self.url = config['simplepush_url']
+        self.digest_interval = config.get('simplepush_digest_minutes', 0) * 60
+        self.max_attempts = config.get('simplepush_max_attempts', 3)
+        self.flush_timeout = config.get('simplepush_flush_timeout', 10)
+        self.retry_delay = 60
+        self.state_path = os.path.join(config.get('cache_dir', 'cache'), 'simplepush_digest.json')
         self.logger = logging.getLogger(__name__)
+        self.session = create_session(config)
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
 
     def send_notification(self, title, message, event="airbnb-access"):
         if not self.enabled:
             self.logger.debug("Simplepush is not enabled. Skipping notification.")
             return
-        url = f"{self.url}/{self.key}/{title}/{message}/event/{event}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            self.logger.error("Failed to send Simplepush notification")
-        else:
-            self.logger.debug("Simplepush notification sent successfully")
+        # Delivery happens on a background thread so a slow or failing
+        # Simplepush endpoint never adds to sync time.
+        self._queue.put({'title': title, 'message': message, 'event': event, 'time': time.time()})
+        self._ensure_worker()
+
+    def resume(self):
+        # A digest held back by an earlier run is sent once its interval has
+        # passed, even when this run has nothing new to add to it.
+        if not self.enabled:
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+        state = self._load_state()
+        if state['pending'] and time.time() >= state['last_sent'] + self.digest_interval:
+            self._ensure_worker()
+
+    def close(self, timeout=None):
+        self.resume()
+        with self._thread_lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        thread.join(self.flush_timeout if timeout is None else timeout)
+        if thread.is_alive():
+            self.logger.warning("Simplepush delivery still pending at shutdown; it will be retried on the next run")
+
+    def _ensure_worker(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="simplepush", daemon=True)
+                self._thread.start()
+
+    def _load_state(self):
+        state = read_json(self.state_path) or {}
+        return {'pending': state.get('pending', []), 'last_sent': state.get('last_sent', 0)}
+
+    def _save_state(self, state):
+        try:
+            write_json_atomic(self.state_path, state)
+        except OSError as e:
+            self.logger.error(f"Failed to save Simplepush digest state: {str(e)}")
+
+    def _collect(self, state, wait):
+        try:
+            item = self._queue.get(timeout=wait)
+        except queue.Empty:
+            return
+        while True:
+            if item is not None:
+                state['pending'].append(item)
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._save_state(state)
+
+    def _run(self):
+        # Pending events live on disk, so events from separate cron runs or
+        # daemon ticks are coalesced into one digest per interval.
+        state = self._load_state()
+        retry_at = 0
+        while True:
+            if self._stopping.is_set():
+                wait = 0
+            elif state['pending']:
+                wait = max(0.0, max(state['last_sent'] + self.digest_interval, retry_at) - time.time())
+            else:
+                wait = None
+            self._collect(state, wait)
+
+            now = time.time()
+            if state['pending'] and now >= state['last_sent'] + self.digest_interval and now >= retry_at:
+                if self._deliver(state['pending']):
+                    state = {'pending': [], 'last_sent': time.time()}
+                    self._save_state(state)
+                else:
+                    retry_at = time.time() + self.retry_delay
+            if self._stopping.is_set() and self._queue.empty():
+                return
+
+    def _digest(self, pending):
+        if len(pending) == 1:
+            return pending[0]['title'], pending[0]['message'], pending[0]['event']
+        titles = {item['title'] for item in pending}
+        title = titles.pop() if len(titles) == 1 else "UniFi Access Update"
+        message = "\n\n".join(
+            f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(item['time']))}\n{item['message']}" for item in pending
+        )
+        return f"{title} ({len(pending)} updates)", message, pending[-1]['event']
+
+    def _deliver(self, pending):
+        title, message, event = self._digest(pending)
+        data = {"key": self.key, "title": title, "msg": message, "event": event}
+        for attempt in range(self.max_attempts):
+            try:
+                response = self.session.post(self.url, data=data)
+                if response.status_code == 200:
+                    self.logger.debug("Simplepush notification sent successfully")
+                    return True
+                self.logger.error(f"Failed to send Simplepush notification. Status code: {response.status_code}")
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Failed to send Simplepush notification: {str(e)}")
+            if attempt + 1 < self.max_attempts and not self._stopping.is_set():
+                time.sleep(random.uniform(0, min(30, 2 ** attempt)))
+        return False
@@ -0,0 +1,306 @@
+import datetime
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Optional
+from records import DateNormalizer, normalize_reservations, normalize_visitors
+from utils import actionable_window
+
+@dataclass
+class VisitorCreate:
+    reservation_id: Optional[str]
+    content_hash: str
+    guest_name: str
+    first_name: str
+    last_name: str
+    phone_number: str
+    check_in_date: datetime.date
+    check_out_date: datetime.date
+    start_time: int
+    end_time: int
+    pin_code: str
+    replaces: Optional[str] = None
+    reuses_pin_of: Optional[str] = None
+
+@dataclass
+class VisitorDelete:
+    visitor_id: str
+    name: str
+    is_completed: bool
+    reason: str
+
+@dataclass
+class PinUpdate:
+    visitor_id: str
+    name: str
+    pin_code: str
+    reuses_pin_of: Optional[str] = None
+
+@dataclass
+class Adoption:
+    reservation_id: str
+    visitor_id: str
+    content_hash: str
+    pin_code: Optional[str]
+
+@dataclass
+class PinConflict:
+    name: str
+    pin_code: str
+    holder: str
+    resolved_pin: Optional[str]
+
+    def describe(self):
+        message = f"{self.name} wanted PIN {self.pin_code}, already used by {self.holder}"
+        if self.resolved_pin is None:
+            return message
+        return f"{message}; assigned {self.resolved_pin}" if self.resolved_pin else f"{message}; no PIN assigned"
+
+@dataclass
+class SyncPlan:
+    creates: List[VisitorCreate] = field(default_factory=list)
+    deletes: List[VisitorDelete] = field(default_factory=list)
+    pin_updates: List[PinUpdate] = field(default_factory=list)
+    adoptions: List[Adoption] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    missing_pins: List[str] = field(default_factory=list)
+    pin_conflicts: List[PinConflict] = field(default_factory=list)
+    reservation_count: int = 0
+
+    def has_mutations(self):
+        return bool(self.creates or self.deletes or self.pin_updates)
+
+    def describe(self):
+        lines = [f"Plan for {self.reservation_count} reservations: "
+                 f"{len(self.creates)} create(s), {len(self.deletes)} delete(s), "
+                 f"{len(self.pin_updates)} PIN update(s), {len(self.unchanged)} unchanged"]
+        for create in self.creates:
+            pin = f", PIN {create.pin_code}" if create.pin_code else ", no PIN"
+            lines.append(f"  create {create.guest_name} ({create.check_in_date} to {create.check_out_date}{pin})")
+        for delete in self.deletes:
+            lines.append(f"  delete {delete.name} ({delete.reason})")
+        for update in self.pin_updates:
+            lines.append(f"  set PIN {update.pin_code} for {update.name}")
+        for name in self.missing_pins:
+            lines.append(f"  no PIN available for {name}")
+        for conflict in self.pin_conflicts:
+            lines.append(f"  PIN conflict: {conflict.describe()}")
+        return "\n".join(lines)
+
+def derive_pin(phone_number, digits):
+    return phone_number[-digits:] if phone_number and len(phone_number) >= digits else ""
+
+def fallback_pin(seed, digits, attempt=0):
+    # The same seed and attempt always give the same code, so recomputing a
+    # plan hands a guest the same fallback PIN.
+    digest = hashlib.sha256(f"{seed}:{attempt}".encode()).digest()
+    return str(int.from_bytes(digest[:8], "big") % 10 ** digits).zfill(digits)
+
+class PinIndex:
+    # Active PINs keyed by code, so collision checks while handing out new
+    # PINs are a single lookup.
+    max_attempts = 32
+
+    def __init__(self, digits):
+        self.digits = digits
+        self.holders = {}
+
+    def holder(self, pin_code):
+        return self.holders.get(pin_code)
+
+    def claim(self, pin_code, holder):
+        if pin_code in self.holders:
+            return False
+        self.holders[pin_code] = holder
+        return True
+
+    def allocate(self, pin_code, seed, holder):
+        if self.claim(pin_code, holder):
+            return pin_code
+        for attempt in range(self.max_attempts):
+            candidate = fallback_pin(seed, self.digits, attempt)
+            if self.claim(candidate, holder):
+                return candidate
+        return ""
+
+def known_pin(visitor, stored_pins):
+    # The controller may report a PIN as an opaque token, so the code stored
+    # when this tool assigned it is used instead.
+    return visitor.pin_code if isinstance(visitor.pin_code, str) else stored_pins.get(visitor.id)
+
+def build_pin_index(visitors, stored_pins, digits, released=()):
+    # Without a known code the phone-derived one is only a guess: it is still
+    # held back from new assignments, but a clash with a guess is never
+    # reported as a conflict.
+    index = PinIndex(digits)
+    conflicts = []
+    guessed = []
+    for visitor in visitors:
+        if visitor.id in released or not visitor.pin_code:
+            continue
+        pin_code = known_pin(visitor, stored_pins)
+        if not pin_code:
+            guessed.append(visitor)
+        elif not index.claim(pin_code, visitor.name):
+            conflicts.append(PinConflict(visitor.name, pin_code, index.holder(pin_code), None))
+    for visitor in guessed:
+        pin_code = derive_pin(visitor.phone_number, digits)
+        if pin_code:
+            index.claim(pin_code, visitor.name)
+    return index, conflicts
+
+def assign_pins(plan, visitors, stored_pins, digits, released):
+    # PINs of visitors deleted by this plan are free again, since apply_plan
+    # runs deletes before creates and PIN updates. Each create or update
+    # that takes such a PIN records whose it was, so it can be held back if
+    # that delete fails.
+    index, plan.pin_conflicts = build_pin_index(visitors, stored_pins, digits, released)
+    released_pins = {}
+    for visitor in visitors:
+        if visitor.id in released and visitor.pin_code:
+            pin_code = known_pin(visitor, stored_pins) or derive_pin(visitor.phone_number, digits)
+            if pin_code:
+                released_pins[pin_code] = visitor.id
+    for create in plan.creates:
+        if create.pin_code:
+            pin_code = index.allocate(create.pin_code, create.reservation_id or create.phone_number, create.guest_name)
+            if pin_code != create.pin_code:
+                plan.pin_conflicts.append(PinConflict(create.guest_name, create.pin_code,
+                                                      index.holder(create.pin_code), pin_code))
+                create.pin_code = pin_code
+            create.reuses_pin_of = released_pins.get(pin_code)
+    pin_updates = []
+    for update in plan.pin_updates:
+        pin_code = index.allocate(update.pin_code, update.visitor_id, update.name)
+        if pin_code != update.pin_code:
+            plan.pin_conflicts.append(PinConflict(update.name, update.pin_code, index.holder(update.pin_code), pin_code))
+        if pin_code:
+            pin_updates.append(PinUpdate(update.visitor_id, update.name, pin_code, released_pins.get(pin_code)))
+    plan.pin_updates = pin_updates
+
+def build_visitor_index(visitors):
+    index = {}
+    for visitor in visitors:
+        index.setdefault((visitor.start_day, visitor.end_day), []).append(visitor)
+    return index
+
+def match_visitor(index, reservation, matched=None):
+    candidates = index.get((reservation.check_in, reservation.check_out), [])
+    # Each visitor can satisfy only one reservation, so reservations that
+    # share a date pair are matched to distinct visitors.
+    if matched is not None:
+        candidates = [v for v in candidates if v.id not in matched]
+    if not candidates:
+        return None
+    match = None
+    if reservation.phone_number:
+        match = next((v for v in candidates if v.phone_number == reservation.phone_number), None)
+    if match is None and reservation.guest_name:
+        match = next((v for v in candidates if v.name.strip() == reservation.guest_name), None)
+    if match is None:
+        match = candidates[0]
+    if matched is not None:
+        matched.add(match.id)
+    return match
+
+def compute_plan(reservations, visitors, records, check_in_time, check_out_time, pin_code_digits, today=None,
+                 targeted=False, delete_stale=True, door_group_id=None, visitor_pins=None):
+    # Pure diff between the reservation source, the visitor snapshot and the
+    # state store records; nothing here talks to the controller. A targeted
+    # plan only covers the given reservations and skips the sweeps over the
+    # whole visitor list, which the periodic full sync still runs.
+    today, last_day = actionable_window(today)
+    first_ordinal, last_ordinal = today.toordinal(), last_day.toordinal()
+    normalizer = DateNormalizer()
+    all_visitors = normalize_visitors(visitors, normalizer)
+    # On a controller shared by several properties each one only matches,
+    # deletes and re-PINs the visitors on its own door group. PINs are unique
+    # per controller, so the PIN index still covers every visitor.
+    if door_group_id:
+        visitors = [v for v in all_visitors if door_group_id in v.door_groups]
+    else:
+        visitors = all_visitors
+    visitor_index = build_visitor_index(visitors)
+    visitors_by_id = {v.id: v for v in visitors}
+    # Visitors already mapped to a reservation in the state store are never
+    # handed to a different reservation by date matching. Targeted plans pass
+    # the mapping separately since their records cover only the given
+    # reservations.
+    if visitor_pins is None:
+        visitor_pins = {r['visitor_id']: r['pin_code'] for r in records.values() if r['visitor_id']}
+    matched_visitors = set(visitor_pins)
+
+    plan = SyncPlan()
+    pin_updates = {}
+    replaced = set()
+    for reservation in normalize_reservations(reservations, normalizer):
+        plan.reservation_count += 1
+        reservation_id = reservation.reservation_id
+        record = records.get(reservation_id) if reservation_id else None
+        if reservation.status != "accepted":
+            # Cancelled reservations only show up through targeted syncs; the
+            # visitor mapped to them is removed straight away.
+            visitor = visitors_by_id.get(record['visitor_id']) if record and record['visitor_id'] else None
+            if visitor and visitor.id not in replaced:
+                plan.deletes.append(VisitorDelete(visitor.id, visitor.name, False, "reservation cancelled"))
+                replaced.add(visitor.id)
+            continue
+
+        # A changed reservation always loses its old visitor, so the old
+        # dates stop granting access. It is recreated when the stay falls in
+        # the window or is already under way; only a stay moved beyond the
+        # window (or one that has ended) is left without a visitor until later.
+        visitor = visitors_by_id.get(record['visitor_id']) if record and record['visitor_id'] else None
+        changed = visitor is not None and record['content_hash'] != reservation.content_hash
+        replaces = None
+        if changed:
+            plan.deletes.append(VisitorDelete(visitor.id, visitor.name, False, "reservation changed"))
+            replaced.add(visitor.id)
+            replaces, visitor = visitor.id, None
+        in_stay = changed and reservation.check_in < first_ordinal <= reservation.check_out
+        if not (first_ordinal <= reservation.check_in <= last_ordinal or in_stay):
+            continue
+        if not visitor and not changed:
+            visitor = match_visitor(visitor_index, reservation, matched_visitors)
+            if visitor and reservation_id:
+                plan.adoptions.append(Adoption(reservation_id, visitor.id, reservation.content_hash,
+                                               visitor.pin_code if isinstance(visitor.pin_code, str) else None))
+
+        pin_code = derive_pin(reservation.phone_number, pin_code_digits)
+        if visitor:
+            plan.unchanged.append(visitor.name)
+            if not visitor.pin_code and pin_code:
+                pin_updates[visitor.id] = PinUpdate(visitor.id, visitor.name, pin_code)
+        else:
+            check_in_date, check_out_date = reservation.check_in_date, reservation.check_out_date
+            plan.creates.append(VisitorCreate(
+                reservation_id, reservation.content_hash, reservation.guest_name,
+                reservation.first_name, reservation.last_name, reservation.phone_number,
+                check_in_date, check_out_date,
+                int(datetime.datetime.combine(check_in_date, check_in_time).timestamp()),
+                int(datetime.datetime.combine(check_out_date, check_out_time).timestamp()),
+                pin_code, replaces
+            ))
+
+    if delete_stale and not targeted:
+        for visitor in visitors:
+            is_completed = visitor.status == "VISITED"
+            if (visitor.end_day < first_ordinal or is_completed) and visitor.id not in replaced:
+                plan.deletes.append(VisitorDelete(visitor.id, visitor.name, is_completed,
+                                                  "visit completed" if is_completed else "stay ended"))
+
+    # Any remaining visitor without a PIN gets one from its own phone number.
+    # Visitors about to be deleted are skipped, and each visitor gets at most
+    # one PIN update per plan.
+    deleted_ids = {delete.visitor_id for delete in plan.deletes}
+    if not targeted:
+        for visitor in visitors:
+            if visitor.id in deleted_ids or visitor.id in pin_updates or visitor.pin_code:
+                continue
+            pin_code = derive_pin(visitor.phone_number, pin_code_digits)
+            if pin_code:
+                pin_updates[visitor.id] = PinUpdate(visitor.id, visitor.name, pin_code)
+            else:
+                plan.missing_pins.append(visitor.name)
+    plan.pin_updates = [update for visitor_id, update in pin_updates.items() if visitor_id not in deleted_ids]
+    assign_pins(plan, all_visitors, visitor_pins, pin_code_digits, deleted_ids)
+    return plan
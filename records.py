@@ -0,0 +1,111 @@
+import datetime
+from state_store import reservation_hash
+
+class ReservationRecord:
+    __slots__ = ('reservation_id', 'check_in', 'check_out', 'status', 'guest_name',
+                 'first_name', 'last_name', 'phone_number', 'content_hash')
+
+    def __init__(self, reservation_id, check_in, check_out, status, guest_name, phone_number, content_hash):
+        self.reservation_id = reservation_id
+        # Dates are stored as proleptic Gregorian ordinals for cheap comparisons
+        self.check_in = check_in
+        self.check_out = check_out
+        self.status = status
+        self.guest_name = guest_name
+        self.first_name, self.last_name = guest_name.split(" ", 1) if " " in guest_name else (guest_name, "")
+        self.phone_number = phone_number
+        self.content_hash = content_hash
+
+    @property
+    def check_in_date(self):
+        return datetime.date.fromordinal(self.check_in)
+
+    @property
+    def check_out_date(self):
+        return datetime.date.fromordinal(self.check_out)
+
+class VisitorRecord:
+    __slots__ = ('id', 'first_name', 'last_name', 'phone_number', 'start_time', 'end_time',
+                 'start_day', 'end_day', 'status', 'pin_code', 'door_groups')
+
+    def __init__(self, visitor_id, first_name, last_name, phone_number, start_time, end_time,
+                 start_day, end_day, status, pin_code, door_groups=frozenset()):
+        self.id = visitor_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.phone_number = phone_number
+        self.start_time = start_time
+        self.end_time = end_time
+        self.start_day = start_day
+        self.end_day = end_day
+        self.status = status
+        self.pin_code = pin_code
+        self.door_groups = door_groups
+
+    @property
+    def name(self):
+        return f"{self.first_name} {self.last_name}"
+
+class DateNormalizer:
+    # Reservations and visitors share a small set of distinct dates and
+    # timestamps, so each distinct value is converted only once per batch.
+    def __init__(self):
+        self._dates = {}
+        self._epochs = {}
+
+    def date_ordinal(self, value):
+        ordinal = self._dates.get(value)
+        if ordinal is None:
+            if isinstance(value, datetime.datetime):
+                ordinal = value.date().toordinal()
+            elif isinstance(value, datetime.date):
+                ordinal = value.toordinal()
+            else:
+                ordinal = datetime.date.fromisoformat(value[:10]).toordinal()
+            self._dates[value] = ordinal
+        return ordinal
+
+    def epoch_ordinal(self, epoch):
+        ordinal = self._epochs.get(epoch)
+        if ordinal is None:
+            ordinal = self._epochs[epoch] = datetime.datetime.fromtimestamp(epoch).toordinal()
+        return ordinal
+
+def normalize_reservation(reservation, normalizer):
+    guests = reservation.get("guests") or []
+    guest = guests[0] if guests else {}
+    return ReservationRecord(
+        reservation.get("reservation_code"),
+        normalizer.date_ordinal(reservation["check_in_date"]),
+        normalizer.date_ordinal(reservation["check_out_date"]),
+        reservation.get("status"),
+        guest.get("name", "Guest"),
+        guest.get("phone") or "",
+        reservation_hash(reservation),
+    )
+
+def normalize_reservations(reservations, normalizer=None):
+    normalizer = normalizer or DateNormalizer()
+    for reservation in reservations:
+        yield normalize_reservation(reservation, normalizer)
+
+def normalize_visitor(visitor, normalizer):
+    start_time = int(visitor["start_time"])
+    end_time = int(visitor["end_time"])
+    return VisitorRecord(
+        visitor["id"],
+        visitor.get("first_name") or "",
+        visitor.get("last_name") or "",
+        visitor.get("mobile_phone") or "",
+        start_time,
+        end_time,
+        normalizer.epoch_ordinal(start_time),
+        normalizer.epoch_ordinal(end_time),
+        visitor.get("status"),
+        visitor.get("pin_code"),
+        frozenset(r.get("id") for r in visitor.get("resources") or [] if r.get("type") == "door_group"),
+    )
+
+def normalize_visitors(visitors, normalizer=None):
+    normalizer = normalizer or DateNormalizer()
+    return [normalize_visitor(visitor, normalizer) for visitor in visitors]
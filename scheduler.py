@@ -0,0 +1,70 @@
+import datetime
+import logging
+import random
+import signal
+import threading
+
+class SyncScheduler:
+    def __init__(self, config, sync):
+        self.sync = sync
+        self.interval = datetime.timedelta(minutes=config['daemon_interval_minutes'])
+        self.jitter = config['daemon_jitter_seconds']
+        self.boundary_lead = datetime.timedelta(minutes=config['daemon_boundary_lead_minutes'])
+        self.check_in_time = datetime.time.fromisoformat(config['check_in_time'])
+        self.check_out_time = datetime.time.fromisoformat(config['check_out_time'])
+        self.logger = logging.getLogger(__name__)
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def boundaries(self, day):
+        # Sync shortly before guests arrive so their PIN is live, and shortly
+        # after they leave so completed visitors are cleaned up.
+        return [
+            datetime.datetime.combine(day, self.check_in_time) - self.boundary_lead,
+            datetime.datetime.combine(day, self.check_out_time) + self.boundary_lead,
+        ]
+
+    def next_boundary(self, now):
+        candidates = self.boundaries(now.date()) + self.boundaries(now.date() + datetime.timedelta(days=1))
+        return min(b for b in candidates if b > now)
+
+    def next_run(self, now):
+        scheduled = now + self.interval + datetime.timedelta(seconds=random.uniform(-self.jitter, self.jitter))
+        return min(scheduled, self.next_boundary(now))
+
+    def trigger(self, signum=None, frame=None):
+        self.logger.info("Immediate sync requested")
+        self._wake.set()
+
+    def stop(self, signum=None, frame=None):
+        self.logger.info("Shutdown requested, stopping after the current sync")
+        self._stopping.set()
+        self._wake.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.trigger)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.trigger)
+
+    def run_once(self):
+        try:
+            self.sync()
+        except Exception as e:
+            self.logger.error(f"Sync failed: {str(e)}", exc_info=True)
+
+    def run(self):
+        self.install_signal_handlers()
+        self.logger.info("Daemon started")
+        while not self._stopping.is_set():
+            self.run_once()
+            if self._stopping.is_set():
+                break
+            now = datetime.datetime.now()
+            next_run = self.next_run(now)
+            self.logger.info(f"Next sync scheduled at {next_run.isoformat(timespec='seconds')}")
+            self._wake.wait(max(0, (next_run - now).total_seconds()))
+            self._wake.clear()
+        self.logger.info("Daemon stopped")
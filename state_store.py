@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+def reservation_hash(reservation):
+    # Only the fields that end up on the visitor, so edits that never reach
+    # the controller (guest email, notes, ...) do not trigger a replacement.
+    guests = reservation.get("guests") or []
+    guest = guests[0] if guests else {}
+    content = {
+        "check_in_date": str(reservation["check_in_date"]),
+        "check_out_date": str(reservation["check_out_date"]),
+        "status": reservation.get("status"),
+        "name": guest.get("name", "Guest"),
+        "phone": guest.get("phone") or "",
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # Autocommit mode: every write is its own durable transaction, so a
+        # crash can never lose a mapping that was already written.
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS reservations ("
+            " reservation_id TEXT PRIMARY KEY,"
+            " visitor_id TEXT,"
+            " pin_code TEXT,"
+            " content_hash TEXT NOT NULL,"
+            " updated_at INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS reservations_visitor_id ON reservations (visitor_id)")
+        self.logger.debug(f"Opened state store at {path}")
+
+    def get(self, reservation_id):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM reservations WHERE reservation_id = ?", (reservation_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def visitor_pins(self):
+        # Just the visitor mapping, for plans that look up reservations one
+        # at a time with get() instead of loading every row.
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT visitor_id, pin_code FROM reservations WHERE visitor_id IS NOT NULL"
+            ).fetchall()
+        return {row['visitor_id']: row['pin_code'] for row in rows}
+
+    def load(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT * FROM reservations").fetchall()
+        return {row['reservation_id']: dict(row) for row in rows}
+
+    def record_pending(self, reservation_id, content_hash):
+        # Written before the visitor is created; a row without a visitor_id
+        # marks a create whose outcome is unknown and is re-matched next run.
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO reservations (reservation_id, visitor_id, pin_code, content_hash, updated_at)"
+                " VALUES (?, NULL, NULL, ?, ?)"
+                " ON CONFLICT (reservation_id) DO UPDATE SET visitor_id = NULL, pin_code = NULL,"
+                " content_hash = excluded.content_hash, updated_at = excluded.updated_at",
+                (reservation_id, content_hash, int(time.time()))
+            )
+
+    def record_visitor(self, reservation_id, visitor_id, content_hash, pin_code=None):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO reservations (reservation_id, visitor_id, pin_code, content_hash, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (reservation_id) DO UPDATE SET visitor_id = excluded.visitor_id,"
+                " pin_code = excluded.pin_code, content_hash = excluded.content_hash,"
+                " updated_at = excluded.updated_at",
+                (reservation_id, visitor_id, pin_code, content_hash, int(time.time()))
+            )
+
+    def set_pin(self, visitor_id, pin_code):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE reservations SET pin_code = ?, updated_at = ? WHERE visitor_id = ?",
+                (pin_code, int(time.time()), visitor_id)
+            )
+
+    def remove_visitor(self, visitor_id):
+        with self._lock:
+            self.conn.execute("DELETE FROM reservations WHERE visitor_id = ?", (visitor_id,))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from metrics import TimedIterator, export_run, metrics
+from notification import NotificationManager
+from unifi_access import UnifiAccessManager
+from utils import actionable_window
+
+class SyncManager:
+    def __init__(self, config, unifi_manager, notification_manager=None):
+        self.config = config
+        self.unifi_manager = unifi_manager
+        self._hostex_manager = None
+        self._ics_parser = None
+        self._notification_manager = notification_manager
+        self.logger = logging.getLogger(__name__)
+        # Webhook events and scheduled syncs share one visitor snapshot, so
+        # they take turns.
+        self._lock = threading.Lock()
+        self.property_name = config.get('property_name', 'default')
+        self.title = "UniFi Access Update"
+        if self.property_name != 'default':
+            self.title += f" ({self.property_name})"
+
+    # Clients are built on first use so only the configured reservation
+    # source (and its dependencies) is ever loaded.
+    @property
+    def hostex_manager(self):
+        if self._hostex_manager is None:
+            from hostex_api import HostexManager
+            self._hostex_manager = HostexManager(self.config)
+        return self._hostex_manager
+
+    @property
+    def ics_parser(self):
+        if self._ics_parser is None:
+            from ics_parser import ICSParser
+            self._ics_parser = ICSParser(self.config)
+        return self._ics_parser
+
+    @property
+    def notification_manager(self):
+        if self._notification_manager is None:
+            self._notification_manager = NotificationManager(self.config)
+        return self._notification_manager
+
+    def fetch_reservations(self):
+        if self.config['use_hostex']:
+            self.logger.info("Fetching reservations from Hostex")
+            # Pages stream straight into the reconciler as they arrive.
+            return self.hostex_manager.iter_reservations(*actionable_window())
+        elif self.config['use_ics']:
+            self.logger.info("Parsing ICS file")
+            return self.ics_parser.parse_ics()
+        self.logger.error("No valid reservation source configured")
+        return None
+
+    def run(self):
+        with self._lock:
+            return self._run()
+
+    def _run(self):
+        # Hostex pages are fetched lazily while the plan is built, so the time
+        # spent waiting on the source is counted separately from matching.
+        started = time.perf_counter()
+        reservations = self.fetch_reservations()
+        fetch_time = time.perf_counter() - started
+        if reservations is None:
+            return None
+        reservations = TimedIterator(reservations)
+
+        # Start every sync from a fresh controller snapshot; in daemon mode the
+        # visitor list may have changed since the previous tick.
+        self.unifi_manager.reset()
+        with metrics.span('fetch_visitors', property=self.property_name):
+            self.unifi_manager.get_visitors()
+
+        self.logger.info("Processing reservations")
+        started = time.perf_counter()
+        plan = self.unifi_manager.plan_sync(reservations)
+        planning_time = time.perf_counter() - started
+        metrics.record_phase('fetch_reservations', fetch_time + reservations.elapsed, property=self.property_name)
+        metrics.record_phase('match', planning_time - reservations.elapsed, property=self.property_name)
+        self.logger.info(f"Processed {plan.reservation_count} reservations")
+        with metrics.span('apply', property=self.property_name):
+            self.unifi_manager.apply_plan(plan)
+        for change in ('added', 'deleted'):
+            metrics.inc('sync_changes_total', len(self.unifi_manager.changes[change]),
+                        property=self.property_name, change=change)
+
+        summary = self.unifi_manager.generate_summary()
+        self.logger.info(summary)
+
+        total_visitors = len(self.unifi_manager.get_visitors())
+        self.logger.info(f"Total visitors remaining after cleanup: {total_visitors}")
+
+        self.notify(summary)
+
+        return summary
+
+    def sync_reservation(self, reservation_code):
+        # Targeted reconcile for one webhook event: only this reservation is
+        # fetched and planned, against the snapshot kept from the last sync.
+        with self._lock:
+            with metrics.span('fetch_reservations', property=self.property_name, scope='event'):
+                reservation = self.hostex_manager.fetch_reservation(reservation_code)
+            if reservation is None:
+                self.logger.debug("Reservation %s not found for property %s", reservation_code, self.property_name)
+                return None
+            self.logger.info(f"Syncing reservation {reservation_code} ({reservation.get('status')})")
+            self.unifi_manager.reset(keep_snapshot=True)
+            with metrics.span('match', property=self.property_name, scope='event'):
+                plan = self.unifi_manager.plan_sync([reservation], targeted=True)
+            with metrics.span('apply', property=self.property_name, scope='event'):
+                self.unifi_manager.apply_plan(plan)
+            for change in ('added', 'deleted'):
+                metrics.inc('sync_changes_total', len(self.unifi_manager.changes[change]),
+                            property=self.property_name, change=change)
+            summary = self.unifi_manager.generate_summary()
+            self.logger.info(summary)
+            self.notify(summary)
+            return summary
+
+    def close(self):
+        # Waits for a sync or webhook event in progress before closing
+        with self._lock:
+            self.unifi_manager.close()
+
+    def notify(self, summary):
+        if self.config['simplepush_enabled'] and self.unifi_manager.has_changes():
+            self.notification_manager.send_notification(self.title, summary)
+            self.logger.info("Simplepush notification queued")
+        else:
+            self.logger.info("No Simplepush notification sent (no changes or Simplepush not enabled)")
+
+    def plan(self):
+        reservations = self.fetch_reservations()
+        if reservations is None:
+            return None
+        self.unifi_manager.reset()
+        return self.unifi_manager.plan_sync(reservations).describe()
+
+class PortfolioSyncManager:
+    def __init__(self, config):
+        self.config = config
+        self.properties = config['properties']
+        self.max_parallel = max(1, min(config['max_parallel_properties'], len(self.properties)))
+        self.logger = logging.getLogger(__name__)
+        self.sync_managers = {}
+        # One notifier for every property so their updates share a digest
+        self.notification_manager = NotificationManager(config) if config['simplepush_enabled'] else None
+        # Properties sharing a controller take turns for these slots so one
+        # site's sync cannot flood a controller that serves several units.
+        per_controller = max(1, config['max_concurrent_per_controller'])
+        self.controller_slots = {
+            prop['api_host']: threading.BoundedSemaphore(per_controller) for prop in self.properties
+        }
+
+    def get_sync_manager(self, prop):
+        name = prop['property_name']
+        if name not in self.sync_managers:
+            self.sync_managers[name] = SyncManager(prop, UnifiAccessManager(prop), self.notification_manager)
+        return self.sync_managers[name]
+
+    def sync_property(self, prop, action):
+        name = prop['property_name']
+        with self.controller_slots[prop['api_host']]:
+            try:
+                return action(self.get_sync_manager(prop))
+            except Exception as e:
+                self.logger.error(f"Sync failed for property {name}: {str(e)}", exc_info=True)
+                return None
+
+    def for_each_property(self, action):
+        if len(self.properties) == 1:
+            return [self.sync_property(self.properties[0], action)]
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            return list(executor.map(lambda prop: self.sync_property(prop, action), self.properties))
+
+    def combine(self, results):
+        if len(self.properties) == 1:
+            return results[0]
+        completed = [(prop['property_name'], result) for prop, result in zip(self.properties, results) if result is not None]
+        self.logger.info(f"Synced {len(completed)} of {len(self.properties)} properties")
+        if not completed:
+            return None
+        return "\n\n".join(f"[{name}] {result}" for name, result in completed)
+
+    def run(self):
+        metrics.start_run()
+        results = self.for_each_property(SyncManager.run)
+        report = metrics.finish_run(all(result is not None for result in results))
+        if self.notification_manager:
+            self.notification_manager.resume()
+        try:
+            export_run(report, self.config)
+        except OSError as e:
+            self.logger.error(f"Failed to export metrics: {str(e)}")
+        return self.combine(results)
+
+    def plan(self):
+        return self.combine(self.for_each_property(SyncManager.plan))
+
+    def sync_reservation(self, reservation_code, property_id=None):
+        # Only Hostex properties receive webhooks; when the event names a
+        # listing, properties bound to a different listing are skipped.
+        targets = [
+            prop for prop in self.properties
+            if prop['use_hostex'] and (property_id is None or not prop.get('hostex_property_id')
+                                       or str(prop['hostex_property_id']) == str(property_id))
+        ]
+        results = [
+            self.sync_property(prop, lambda manager: manager.sync_reservation(reservation_code))
+            for prop in targets
+        ]
+        synced = any(result is not None for result in results)
+        metrics.inc('webhook_syncs_total', result='synced' if synced else 'not_found')
+        if not synced:
+            self.logger.warning(f"Reservation {reservation_code} from webhook did not match any property")
+        return synced
+
+    def close(self):
+        for sync_manager in self.sync_managers.values():
+            sync_manager.close()
+        if self.notification_manager:
+            self.notification_manager.close()
@@ -1,7 +1,17 @@
 import requests
 import datetime
-import json
+import hashlib
 import logging
+import os
+import time
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from http_client import create_session
+from metrics import metrics
+from reconcile import compute_plan, derive_pin
+from state_store import StateStore
+from utils import read_json, write_json_atomic
 
 class UnifiAccessManager:
     def __init__(self, config):
@@ -11,8 +21,20 @@ class UnifiAccessManager:
         self.check_in_time = datetime.time.fromisoformat(config['check_in_time'])
         self.check_out_time = datetime.time.fromisoformat(config['check_out_time'])
         self.pin_code_digits = config['pin_code_digits']
+        self.max_workers = max(1, config.get('max_workers', 1))
+        self.shared_controller = config.get('shared_controller', False)
+        self.door_group_cache_ttl = config.get('door_group_cache_ttl_minutes', 1440) * 60
+        host_key = hashlib.sha256(self.api_host.encode()).hexdigest()[:16]
+        self.door_group_cache_path = os.path.join(config.get('cache_dir', 'cache'), f"door_group_{host_key}.json")
         self.logger = logging.getLogger(__name__)
-        self.changes = {'added': [], 'deleted': [], 'unchanged': []}
+        self.session = create_session(config, headers={
+            "Authorization": f"Bearer {self.api_token}",
+            "Content-Type": "application/json"
+        }, verify=False)
+        self.changes = {'added': [], 'deleted': [], 'unchanged': [], 'pin_conflicts': []}
+        self.state_store = StateStore(config['state_db']) if config.get('state_db') else None
+        self._visitors = None
+        self._snapshot_lock = threading.Lock()
         
         self.logger.debug(f"Loaded default_door_group_id from config: {self.default_door_group_id}")
         if not self.default_door_group_id:
@@ -22,10 +44,20 @@ class UnifiAccessManager:
             self.logger.debug(f"Initialized with default_door_group_id: {self.default_door_group_id}")
 
     def set_default_door_group(self):
+        cached = read_json(self.door_group_cache_path)
+        if cached and time.time() - cached.get('resolved_at', 0) < self.door_group_cache_ttl:
+            self.default_door_group_id = cached['id']
+            self.logger.debug(f"Using cached default_door_group_id: {self.default_door_group_id}")
+            return
+
         door_groups = self.fetch_door_groups()
         if len(door_groups) == 1:
             self.default_door_group_id = door_groups[0]['id']
             self.logger.info(f"Automatically set default_door_group_id to the only available group: {self.default_door_group_id}")
+            try:
+                write_json_atomic(self.door_group_cache_path, {'id': self.default_door_group_id, 'resolved_at': time.time()})
+            except OSError as e:
+                self.logger.warning(f"Failed to cache default_door_group_id: {str(e)}")
         elif len(door_groups) > 1:
             self.logger.error("Multiple door groups available. Please specify default_group_id in unifi.conf")
             raise ValueError("Multiple door groups available. Please specify default_group_id in unifi.conf")
@@ -33,13 +65,10 @@ class UnifiAccessManager:
             self.logger.error("No door groups available")
             raise ValueError("No door groups available")
 
-    def create_visitor(self, first_name, last_name, phone_number, start_time, end_time):
+    def create_visitor(self, first_name, last_name, phone_number, start_time, end_time, reservation_id=None, content_hash=None, pin_code=None):
         url = f"{self.api_host}/api/v1/developer/visitors"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
-        pin_code = phone_number[-self.pin_code_digits:] if phone_number and len(phone_number) >= self.pin_code_digits else ""
+        if pin_code is None:
+            pin_code = derive_pin(phone_number, self.pin_code_digits)
         data = {
             "first_name": first_name,
             "last_name": last_name,
@@ -55,12 +84,16 @@ class UnifiAccessManager:
             ]
         }
         
-        self.logger.debug(f"Creating visitor with data: {json.dumps(data, indent=2)}")
-        
+        self.logger.debug("Creating visitor with data: %s", data)
+
+        if self.state_store and reservation_id:
+            self.state_store.record_pending(reservation_id, content_hash)
+
         try:
-            response = requests.post(url, json=data, headers=headers, verify=False)
-            self.logger.debug(f"API response status code: {response.status_code}")
-            self.logger.debug(f"API response content: {response.text}")
+            response = self.session.post(url, json=data)
+            self.logger.debug("API response status code: %s", response.status_code)
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("API response content: %s", response.text)
             
             response.raise_for_status()
             
@@ -68,10 +101,15 @@ class UnifiAccessManager:
             if response_data.get('code') == 'SUCCESS':
                 visitor_id = response_data.get('data', {}).get('id')
                 if visitor_id:
-                    self.logger.debug(f"Created visitor with ID: {visitor_id}")
+                    self.logger.debug("Created visitor with ID: %s", visitor_id)
+                    visitor = dict(data)
+                    visitor.update(response_data['data'])
+                    self._snapshot_add(visitor)
+                    if self.state_store and reservation_id:
+                        self.state_store.record_visitor(reservation_id, visitor_id, content_hash)
                     if pin_code:
                         self.assign_pin_to_visitor(visitor_id, pin_code)
-                    return True
+                    return visitor_id
                 else:
                     self.logger.error("Visitor ID not found in the response")
                     return False
@@ -84,41 +122,40 @@ class UnifiAccessManager:
 
     def assign_pin_to_visitor(self, visitor_id, pin_code):
         url = f"{self.api_host}/api/v1/developer/visitors/{visitor_id}/pin_codes"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
         data = {"pin_code": pin_code}
         
-        self.logger.debug(f"Assigning PIN {pin_code} to visitor {visitor_id}")
-        self.logger.debug(f"Request URL: {url}")
-        self.logger.debug(f"Request data: {json.dumps(data)}")
+        self.logger.debug("Assigning PIN %s to visitor %s", pin_code, visitor_id)
+        self.logger.debug("Request URL: %s", url)
+        self.logger.debug("Request data: %s", data)
         
-        response = requests.put(url, json=data, headers=headers, verify=False)
-        self.logger.debug(f"Assign PIN API response status code: {response.status_code}")
-        self.logger.debug(f"Assign PIN API response content: {response.text}")
+        response = self.session.put(url, json=data)
+        self.logger.debug("Assign PIN API response status code: %s", response.status_code)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Assign PIN API response content: %s", response.text)
         
         if response.status_code != 200:
             self.logger.error(f"Failed to assign PIN code to visitor: {visitor_id}")
             return False
+        self._snapshot_set_pin(visitor_id, pin_code)
+        if self.state_store:
+            self.state_store.set_pin(visitor_id, pin_code)
         return True
 
     def fetch_visitors(self):
         url = f"{self.api_host}/api/v1/developer/visitors"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
-        response = requests.get(url, headers=headers, verify=False)
-        self.logger.debug(f"Fetch visitors API response status code: {response.status_code}")
+        response = self.session.get(url)
+        self.logger.debug("Fetch visitors API response status code: %s", response.status_code)
         
         if response.status_code == 200:
             data = response.json()
             if 'data' in data:
                 visitors = data['data']
-                self.logger.debug(f"Fetched {len(visitors)} visitors")
-                for visitor in visitors:
-                    self.logger.debug(f"Visitor: {visitor['first_name']} {visitor['last_name']}, Phone: {visitor.get('mobile_phone', 'N/A')}, PIN: {'Set' if visitor.get('pin_code') else 'Not Set'}")
+                self.logger.debug("Fetched %s visitors", len(visitors))
+                # Skip the whole per-visitor loop unless debug output is wanted
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    for visitor in visitors:
+                        self.logger.debug("Visitor: %s %s, Phone: %s, PIN: %s", visitor['first_name'], visitor['last_name'],
+                                          visitor.get('mobile_phone', 'N/A'), 'Set' if visitor.get('pin_code') else 'Not Set')
                 return visitors
             else:
                 self.logger.error(f"Unexpected response format: {data}")
@@ -129,93 +166,177 @@ class UnifiAccessManager:
 
     def delete_visitor(self, visitor_id, is_completed=False):
         url = f"{self.api_host}/api/v1/developer/visitors/{visitor_id}"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
         params = {"is_force": "true"} if is_completed else {}
         
-        response = requests.delete(url, headers=headers, params=params, verify=False)
-        self.logger.debug(f"Delete visitor API response status code: {response.status_code}")
+        response = self.session.delete(url, params=params)
+        self.logger.debug("Delete visitor API response status code: %s", response.status_code)
         
         if response.status_code != 200:
             self.logger.error(f"Failed to delete visitor account: {visitor_id}")
             return False
+        self._snapshot_remove(visitor_id)
+        if self.state_store:
+            self.state_store.remove_visitor(visitor_id)
         return True
 
-    def process_reservations(self, reservations):
-        today = datetime.date.today()
-        next_month = today + datetime.timedelta(days=30)
-        existing_visitors = self.fetch_visitors()
+    def reset(self, keep_snapshot=False):
+        self.changes = {'added': [], 'deleted': [], 'unchanged': [], 'pin_conflicts': []}
+        if keep_snapshot:
+            return
+        with self._snapshot_lock:
+            self._visitors = None
 
-        self.logger.debug(f"Processing {len(reservations)} reservations")
+    def get_visitors(self, refresh=False):
+        # The snapshot is fetched once per run and kept in step with this
+        # run's own creates, deletes and PIN assignments.
+        if self._visitors is None or refresh:
+            self._visitors = self.fetch_visitors()
+        return self._visitors
 
-        for reservation in reservations:
-            check_in_date = datetime.datetime.strptime(reservation["check_in_date"], "%Y-%m-%d").date()
-            check_out_date = datetime.datetime.strptime(reservation["check_out_date"], "%Y-%m-%d").date()
+    def _snapshot_add(self, visitor):
+        with self._snapshot_lock:
+            if self._visitors is not None:
+                self._visitors.append(visitor)
 
-            if today <= check_in_date <= next_month and reservation["status"] == "accepted":
-                guest_name = reservation["guests"][0]["name"] if reservation["guests"] else "Guest"
-                first_name, last_name = guest_name.split(" ", 1) if " " in guest_name else (guest_name, "")
-                phone_number = reservation["guests"][0].get("phone", "") if reservation["guests"] else ""
+    def _snapshot_remove(self, visitor_id):
+        with self._snapshot_lock:
+            if self._visitors is not None:
+                self._visitors = [v for v in self._visitors if v['id'] != visitor_id]
 
-                existing_visitor = next(
-                    (v for v in existing_visitors if
-                     datetime.datetime.fromtimestamp(int(v["start_time"])).date() == check_in_date and
-                     datetime.datetime.fromtimestamp(int(v["end_time"])).date() == check_out_date),
-                    None
-                )
+    def _snapshot_set_pin(self, visitor_id, pin_code):
+        with self._snapshot_lock:
+            if self._visitors is not None:
+                for visitor in self._visitors:
+                    if visitor['id'] == visitor_id:
+                        visitor['pin_code'] = pin_code
+                        break
 
-                if existing_visitor:
-                    self.logger.debug(f"Visitor already exists for dates {check_in_date} to {check_out_date}: {existing_visitor['first_name']} {existing_visitor['last_name']}")
-                    self.changes['unchanged'].append(f"{existing_visitor['first_name']} {existing_visitor['last_name']}")
-                    if not existing_visitor.get('pin_code') and phone_number:
-                        self.assign_pin_to_visitor(existing_visitor['id'], phone_number[-self.pin_code_digits:])
-                else:
-                    start_datetime = datetime.datetime.combine(check_in_date, self.check_in_time)
-                    end_datetime = datetime.datetime.combine(check_out_date, self.check_out_time)
-                    start_timestamp = int(start_datetime.timestamp())
-                    end_timestamp = int(end_datetime.timestamp())
-                    
-                    success = self.create_visitor(first_name, last_name, phone_number, start_timestamp, end_timestamp)
-                    if success:
-                        self.changes['added'].append(guest_name)
-                        self.logger.info(f"Created new visitor: {guest_name}")
-                    else:
-                        self.logger.error(f"Failed to create visitor: {guest_name}")
+    def _run_operation(self, operation):
+        try:
+            return operation()
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Request failed: {str(e)}")
+            return False
 
-        for visitor in existing_visitors:
-            visitor_end = datetime.datetime.fromtimestamp(int(visitor["end_time"])).date()
-            is_completed = visitor.get("status") == "VISITED"
-            if visitor_end < today or is_completed:
-                success = self.delete_visitor(visitor["id"], is_completed)
-                if success:
-                    self.changes['deleted'].append(f"{visitor['first_name']} {visitor['last_name']}")
-                    self.logger.info(f"Deleted visitor: {visitor['first_name']} {visitor['last_name']}")
-                else:
-                    self.logger.error(f"Failed to delete visitor: {visitor['first_name']} {visitor['last_name']}")
+    def run_operations(self, operations):
+        # Each operation is an independent visitor chain (e.g. create followed
+        # by its PIN assignment), so chains may run in parallel while the steps
+        # inside a chain stay ordered. Results are returned in input order.
+        if self.max_workers == 1 or len(operations) <= 1:
+            return [self._run_operation(operation) for operation in operations]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self._run_operation, operations))
 
-    def check_and_update_pins(self):
-        visitors = self.fetch_visitors()
-        self.logger.debug(f"Checking PINs for {len(visitors)} visitors")
-        for visitor in visitors:
-            self.logger.debug(f"Checking visitor: {visitor['first_name']} {visitor['last_name']}")
-            if 'pin_code' not in visitor or not visitor['pin_code']:
-                self.logger.debug(f"Visitor {visitor['first_name']} {visitor['last_name']} has no PIN")
-                phone_number = visitor.get('mobile_phone', '')
-                self.logger.debug(f"Visitor phone number: {phone_number}")
-                pin_code = phone_number[-self.pin_code_digits:] if phone_number and len(phone_number) >= self.pin_code_digits else ""
-                if pin_code:
-                    self.logger.debug(f"Attempting to set PIN {pin_code} for visitor {visitor['id']}")
-                    success = self.assign_pin_to_visitor(visitor['id'], pin_code)
-                    if success:
-                        self.logger.info(f"Updated PIN for visitor: {visitor['first_name']} {visitor['last_name']}")
-                    else:
-                        self.logger.error(f"Failed to update PIN for visitor: {visitor['first_name']} {visitor['last_name']}")
-                else:
-                    self.logger.warning(f"No valid phone number to generate PIN for visitor: {visitor['first_name']} {visitor['last_name']}")
+    def plan_sync(self, reservations, targeted=False, delete_stale=True):
+        records, visitor_pins = {}, None
+        if self.state_store and targeted:
+            # A targeted plan only needs the rows for its own reservations
+            reservations = list(reservations)
+            for reservation in reservations:
+                record = self.state_store.get(reservation.get("reservation_code"))
+                if record:
+                    records[record['reservation_id']] = record
+            visitor_pins = self.state_store.visitor_pins()
+        elif self.state_store:
+            records = self.state_store.load()
+        plan = compute_plan(reservations, self.get_visitors(), records,
+                            self.check_in_time, self.check_out_time, self.pin_code_digits,
+                            targeted=targeted, delete_stale=delete_stale,
+                            door_group_id=self.default_door_group_id if self.shared_controller else None,
+                            visitor_pins=visitor_pins)
+        self.logger.debug("Planned %s creates, %s deletes and %s PIN updates for %s reservations",
+                          len(plan.creates), len(plan.deletes), len(plan.pin_updates), plan.reservation_count)
+        return plan
+
+    def apply_plan(self, plan):
+        if self.state_store:
+            for adoption in plan.adoptions:
+                self.state_store.record_visitor(adoption.reservation_id, adoption.visitor_id,
+                                                adoption.content_hash, adoption.pin_code)
+        self.changes['unchanged'].extend(plan.unchanged)
+        for name in plan.missing_pins:
+            self.logger.warning(f"No valid phone number to generate PIN for visitor: {name}")
+        for conflict in plan.pin_conflicts:
+            self.logger.warning(f"PIN conflict: {conflict.describe()}")
+            self.changes['pin_conflicts'].append(conflict.describe())
+        if plan.pin_conflicts:
+            metrics.inc('pin_conflicts_total', len(plan.pin_conflicts))
+        if not plan.has_mutations():
+            self.logger.debug("Plan has no creates, deletes or PIN updates; nothing to apply")
+            return
+
+        # Deletes run first so the PINs they free can be reused by this
+        # plan's creates and PIN updates without clashing on the controller.
+        delete_results = self.run_operations([
+            metrics.timed('delete', partial(self.delete_visitor, delete.visitor_id, delete.is_completed))
+            for delete in plan.deletes
+        ])
+        # A replacement is only created once the visitor it replaces is gone;
+        # otherwise the old visitor would keep access with no record of it.
+        failed_deletes = {delete.visitor_id for delete, success in zip(plan.deletes, delete_results) if not success}
+        # A PIN freed by a failed delete is still held on the controller, so
+        # it is not sent: the visitor is created without a PIN and the next
+        # sync assigns one, and PIN updates wait for the next sync.
+        creates = []
+        for create in plan.creates:
+            if create.replaces in failed_deletes:
+                self.logger.error(f"Skipped replacing visitor for {create.guest_name}: the old visitor could not be deleted")
+                continue
+            pin_code = create.pin_code
+            if create.reuses_pin_of in failed_deletes:
+                self.logger.warning(f"PIN {pin_code} for {create.guest_name} is still held by a visitor that could not be deleted")
+                pin_code = ""
+            creates.append((create, pin_code))
+        pin_updates = []
+        for update in plan.pin_updates:
+            if update.reuses_pin_of in failed_deletes:
+                self.logger.warning(f"Skipped PIN {update.pin_code} for {update.name}: still held by a visitor that could not be deleted")
+            else:
+                pin_updates.append(update)
+        operations = [
+            metrics.timed('create', partial(self.create_visitor, create.first_name, create.last_name, create.phone_number,
+                                            create.start_time, create.end_time, create.reservation_id,
+                                            create.content_hash, pin_code))
+            for create, pin_code in creates
+        ]
+        operations += [metrics.timed('pin', partial(self.assign_pin_to_visitor, update.visitor_id, update.pin_code))
+                       for update in pin_updates]
+        results = iter(self.run_operations(operations))
+
+        for (create, _), success in zip(creates, results):
+            if success:
+                self.changes['added'].append(create.guest_name)
+                self.logger.info(f"Created new visitor: {create.guest_name}")
+            else:
+                self.logger.error(f"Failed to create visitor: {create.guest_name}")
+
+        for update, success in zip(pin_updates, results):
+            if success:
+                self.logger.info(f"Updated PIN for visitor: {update.name}")
             else:
-                self.logger.debug(f"Visitor {visitor['first_name']} {visitor['last_name']} already has a PIN")
+                self.logger.error(f"Failed to update PIN for visitor: {update.name}")
+
+        for delete, success in zip(plan.deletes, delete_results):
+            if success:
+                self.changes['deleted'].append(delete.name)
+                self.logger.info(f"Deleted visitor: {delete.name}")
+            else:
+                self.logger.error(f"Failed to delete visitor: {delete.name}")
+
+    def process_reservations(self, reservations):
+        plan = self.plan_sync(reservations)
+        self.apply_plan(plan)
+        return plan.reservation_count
+
+    def check_and_update_pins(self):
+        # PIN updates are part of every plan; this covers visitors that were
+        # added to the snapshot without going through a plan.
+        plan = self.plan_sync([], delete_stale=False)
+        self.apply_plan(plan)
+
+    def close(self):
+        if self.state_store:
+            self.state_store.close()
 
     def generate_summary(self):
         summary = "Hostex-UniFi Access Summary:\n"
@@ -227,6 +348,9 @@ class UnifiAccessManager:
         if self.changes['added']:
             added_names = ", ".join(self.changes['added'])
             summary += f"{len(self.changes['added'])} visitor(s) added ({added_names})\n"
+        if self.changes['pin_conflicts']:
+            conflicts = "; ".join(self.changes['pin_conflicts'])
+            summary += f"{len(self.changes['pin_conflicts'])} PIN conflict(s) ({conflicts})\n"
         return summary.strip()
 
     def has_changes(self):
@@ -234,11 +358,7 @@ class UnifiAccessManager:
 
     def fetch_door_groups(self):
         url = f"{self.api_host}/api/v1/developer/door_groups"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json"
-        }
-        response = requests.get(url, headers=headers, verify=False)
+        response = self.session.get(url)
         self.logger.debug(f"Fetch door groups API response status code: {response.status_code}")
         
         if response.status_code == 200:
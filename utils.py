@@ -1,19 +1,56 @@
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
+import os
+import queue
 
-def setup_logging(verbose, log_file):
+ACTIONABLE_DAYS = 30
+
+def actionable_window(today=None):
+    today = today or datetime.date.today()
+    return today, today + datetime.timedelta(days=ACTIONABLE_DAYS)
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_json_atomic(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def setup_logging(verbose, log_file, max_bytes=10 * 1024 * 1024, backup_count=5):
+    level = logging.DEBUG if verbose else logging.INFO
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    # Debug records are only built when -v asks for them; with the root level
+    # at INFO, logger.debug() calls return before formatting anything.
+    logger.setLevel(level)
 
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG if verbose else logging.INFO)
+    ch.setLevel(level)
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
-    fh = logging.FileHandler(log_file)
-    fh.setLevel(logging.DEBUG)
+    # File writes happen on a background listener thread so disk I/O never
+    # blocks the sync itself.
+    fh = logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    fh.setLevel(level)
     fh.setFormatter(formatter)
-    logger.addHandler(fh)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, fh, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
     return logger
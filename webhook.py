@@ -0,0 +1,122 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import metrics
+
+SECRET_HEADER = 'Hostex-Webhook-Secret-Token'
+MAX_BODY_BYTES = 64 * 1024
+
+def _is_identifier(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool) and value != ''
+
+class WebhookReceiver:
+    def __init__(self, config, dispatch):
+        self.port = config['webhook_port']
+        self.path = config['webhook_path']
+        self.secret = config['webhook_secret']
+        if not self.secret:
+            raise ValueError("A webhook secret must be configured before the receiver is enabled")
+        self.dispatch = dispatch
+        self.logger = logging.getLogger(__name__)
+        # Events are acknowledged right away and reconciled one at a time on a
+        # worker thread; a reservation already waiting is not queued twice.
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+
+    def verify(self, token):
+        return hmac.compare_digest((token or '').encode(), self.secret.encode())
+
+    def parse(self, body):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict):
+            return None
+        data = payload.get('data') if isinstance(payload.get('data'), dict) else payload
+        event = payload.get('event') or data.get('event') or ''
+        if not isinstance(event, str):
+            return None
+        if event and not event.startswith('reservation'):
+            return ()
+        reservation_code = data.get('reservation_code') or payload.get('reservation_code')
+        property_id = data.get('property_id') or payload.get('property_id')
+        if not _is_identifier(reservation_code) or not (property_id is None or _is_identifier(property_id)):
+            return None
+        return str(reservation_code), property_id
+
+    def submit(self, reservation_code, property_id=None):
+        with self._pending_lock:
+            if reservation_code in self._pending:
+                metrics.inc('webhook_events_total', result='coalesced')
+                return
+            self._pending.add(reservation_code)
+        self._queue.put((reservation_code, property_id))
+        metrics.inc('webhook_events_total', result='accepted')
+
+    def _run(self):
+        while True:
+            reservation_code, property_id = self._queue.get()
+            with self._pending_lock:
+                self._pending.discard(reservation_code)
+            try:
+                self.dispatch(reservation_code, property_id)
+            except Exception as e:
+                self.logger.error(f"Webhook sync failed for reservation {reservation_code}: {str(e)}", exc_info=True)
+
+    def serve(self, host=''):
+        receiver = self
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path.split('?')[0] != receiver.path:
+                    self._reply(404)
+                    return
+                # The length is checked before anything is read, so a bad or
+                # missing header cannot block the handler on the socket.
+                content_length = self.headers.get('Content-Length')
+                if content_length is None:
+                    self._reply(411)
+                    return
+                if not content_length.strip().isdigit():
+                    self._reply(400)
+                    return
+                length = int(content_length)
+                if length > MAX_BODY_BYTES:
+                    self._reply(413)
+                    return
+                body = self.rfile.read(length)
+                if not receiver.verify(self.headers.get(SECRET_HEADER)):
+                    metrics.inc('webhook_events_total', result='unauthorized')
+                    receiver.logger.warning(f"Rejected webhook from {self.client_address[0]}: bad secret")
+                    self._reply(401)
+                    return
+                event = receiver.parse(body)
+                if event is None:
+                    metrics.inc('webhook_events_total', result='invalid')
+                    self._reply(400)
+                    return
+                if event:
+                    receiver.submit(*event)
+                else:
+                    metrics.inc('webhook_events_total', result='ignored')
+                self._reply(202)
+
+        server = ThreadingHTTPServer((host, self.port), WebhookHandler)
+        server.daemon_threads = True
+        threading.Thread(target=self._run, daemon=True).start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.logger.info(f"Listening for reservation webhooks on port {server.server_address[1]}{self.path}")
+        return server